@@ -35,6 +35,43 @@ SOFTWARE.
 
 import digitalio
 import time
+from micropython import const
+
+# pre-encoded pin change targets clk, not dio (see TM1637._start())
+_BIT_CLK = const(0x02)
+
+try:
+  import array
+  import rp2pio
+  import adafruit_pioasm
+except ImportError:
+  rp2pio = None
+
+# PIO program for TM1637PIO: every FIFO entry is one byte (LSB first) with
+# bit 8 set on the last byte of a transaction. CLK is driven by side-set,
+# DIO by out/set. Both lines idle high.
+_PIO_PROGRAM = """
+.side_set 1
+start:
+    pull block          side 1
+    set pins, 0         side 1 [1]  ; start: DIO falls while CLK is high
+next:
+    set x, 7            side 0
+bitloop:
+    out pins, 1         side 0 [1]
+    nop                 side 1 [1]
+    jmp x-- bitloop     side 0
+    set pins, 0         side 0 [1]
+    nop                 side 1 [1]  ; ack-bit
+    out y, 1            side 0
+    jmp !y more         side 0 [1]
+    nop                 side 1 [1]  ; stop: DIO rises while CLK is high
+    set pins, 1         side 1
+    jmp start           side 1
+more:
+    pull block          side 0
+    jmp next            side 0
+"""
 
 class TM1637(object):
   """Library for quad 7-segment LED modules based on the TM1637 LED driver."""
@@ -44,65 +81,117 @@ class TM1637(object):
   _CMD3   = 0x80      # display control command
   _DSP_ON = 0x08      # display on
   _DELAY  = 0.000010  # 10us delay between clk/dio pulses
+  _USE_DELAY = False  # set in a subclass for boards that toggle pins too fast
   _MSB    = 0x80      # decimal point or colon depending on your display
 
   # 0-9, a-z, blank, dash, star
   _SEGMENTS = bytearray(b'\x3F\x06\x5B\x4F\x66\x6D\x7D\x07\x7F\x6F\x77\x7C\x39\x5E\x79\x71\x3D\x76\x06\x1E\x76\x38\x55\x54\x3F\x73\x67\x50\x6D\x78\x3E\x1C\x2A\x76\x6E\x5B\x00\x40\x63')
 
+  # segments for ASCII codes 0-127, 0xFF for unsupported characters
+  _ASCII = bytearray(b'\xFF' * 128)
+  _ASCII[48:58]  = _SEGMENTS[0:10]   # 0-9
+  _ASCII[65:91]  = _SEGMENTS[10:36]  # uppercase A-Z
+  _ASCII[97:123] = _SEGMENTS[10:36]  # lowercase a-z
+  _ASCII[32] = _SEGMENTS[36]         # space
+  _ASCII[45] = _SEGMENTS[37]         # dash
+  _ASCII[42] = _SEGMENTS[38]         # star/degrees
+
+  # segments for the hex digits 0-f
+  _HEX_DIGITS = bytes(_SEGMENTS[:16])
+
+  # constant parts of temperature()
+  _LO    = bytes((_SEGMENTS[21], _SEGMENTS[24]))  # lo
+  _HI    = bytes((_SEGMENTS[17], _SEGMENTS[18]))  # hi
+  _DEG_C = bytes((_SEGMENTS[38], _SEGMENTS[12]))  # degrees C
+
+  # pin changes (dio, clk high, clk low) for the four bits of each nibble,
+  # LSB first, see _write_byte()
+  _NIBBLE_BITS = tuple(bytes(v for i in range(4)
+                             for v in ((n >> i) & 1, _BIT_CLK | 1, _BIT_CLK))
+                       for n in range(16))
+  # pin changes for the clock of the ack-bit (clk is already low)
+  _ACK_BITS = bytes((_BIT_CLK | 1, _BIT_CLK))
+
   def __init__(self, clk, dio, brightness=7):
     if not 0 <= brightness <= 7:
       raise ValueError("Brightness out of range")
     self._brightness = brightness
-
+    self._scratch = bytearray(8)
+    self._scratch_mv = memoryview(self._scratch)
+    self._shadow = bytearray(6)  # last segments written to each position
+    self._valid  = 0             # bitmask of positions with a known value
+    self._init_bus(clk, dio)
+    self._write_ctrl()
+
+  def _init_bus(self, clk, dio):
+    self._bits = bytearray()
+    # both lines idle high, otherwise the TM1637 misses the first start
     self._clk = digitalio.DigitalInOut(clk)
     self._clk.direction = digitalio.Direction.OUTPUT
-    self._clk.value     = 0
+    self._clk.value     = 1
     self._dio = digitalio.DigitalInOut(dio)
     self._dio.direction = digitalio.Direction.OUTPUT
-    self._dio.value     = 0
-    time.sleep(TM1637._DELAY)
-    self._write_data_cmd()
-    self._write_dsp_ctrl()
+    self._dio.value     = 1
+    if self._USE_DELAY:
+      time.sleep(TM1637._DELAY)
+
+  # The bus-level methods below don't touch the pins. They append the
+  # pin changes to self._bits (bit 1 selects clk instead of dio, bit 0 is
+  # the new level), which _flush_bits() then clocks out in a single loop.
 
   def _start(self):
-    self._dio.value = 0
-    time.sleep(TM1637._DELAY)
-    self._clk.value = 0
-    time.sleep(TM1637._DELAY)
+    bits = self._bits
+    bits.append(0)
+    bits.append(_BIT_CLK)
 
   def _stop(self):
-    self._dio.value = 0
-    time.sleep(TM1637._DELAY)
-    self._clk.value = 1
-    time.sleep(TM1637._DELAY)
-    self._dio.value = 1
+    bits = self._bits
+    bits.append(0)
+    bits.append(_BIT_CLK | 1)
+    bits.append(1)
 
-  def _write_data_cmd(self):
+  def _write_ctrl(self):
     # automatic address increment, normal mode
-    self._start()
-    self._write_byte(TM1637._CMD1)
-    self._stop()
-
-  def _write_dsp_ctrl(self):
+    self._write_many(TM1637._CMD1)
     # display on, set brightness
+    self._write_many(TM1637._CMD3 | TM1637._DSP_ON | self._brightness)
+    self._flush_bits(self._bits)
+
+  def _write_byte(self, b):
+    bits  = self._bits
+    table = TM1637._NIBBLE_BITS
+    bits.extend(table[b & 0x0f])
+    bits.extend(table[(b >> 4) & 0x0f])
+    bits.extend(TM1637._ACK_BITS)
+
+  def _write_many(self, cmd, data=b''):
+    """Encode a single transaction: a command byte followed by data bytes."""
     self._start()
-    self._write_byte(TM1637._CMD3 | TM1637._DSP_ON | self._brightness)
+    self._write_byte(cmd)
+    bits  = self._bits
+    table = TM1637._NIBBLE_BITS
+    ack   = TM1637._ACK_BITS
+    for b in data:
+      bits.extend(table[b & 0x0f])
+      bits.extend(table[(b >> 4) & 0x0f])
+      bits.extend(ack)
     self._stop()
 
-  def _write_byte(self, b):
-    for i in range(8):
-      self._dio.value = (b >> i) & 1
-      time.sleep(TM1637._DELAY)
-      self._clk.value = 1
-      time.sleep(TM1637._DELAY)
-      self._clk.value = 0
-      time.sleep(TM1637._DELAY)
-    self._clk.value = 0
-    time.sleep(TM1637._DELAY)
-    self._clk.value = 1
-    time.sleep(TM1637._DELAY)
-    self._clk.value = 0
-    time.sleep(TM1637._DELAY)
+  def _flush_bits(self, bits):
+    """Clock out and clear a sequence of pre-encoded pin changes."""
+    # local references save attribute lookups in the loop
+    clk   = self._clk
+    dio   = self._dio
+    delay = self._USE_DELAY
+    sleep = time.sleep
+    for s in bits:
+      if s & _BIT_CLK:
+        clk.value = s & 1
+      else:
+        dio.value = s & 1
+      if delay:
+        sleep(TM1637._DELAY)
+    bits[:] = b''
 
   def brightness(self, val=None):
     """Set the display brightness 0-7."""
@@ -114,8 +203,8 @@ class TM1637(object):
       raise ValueError("Brightness out of range")
 
     self._brightness = val
-    self._write_data_cmd()
-    self._write_dsp_ctrl()
+    self._valid = 0 # resend all segments with the next write
+    self._write_ctrl()
 
   def write(self, segments, pos=0):
     """Display up to 6 segments moving right from a given position.
@@ -123,93 +212,182 @@ class TM1637(object):
     and 3rd segments."""
     if not 0 <= pos <= 5:
       raise ValueError("Position out of range")
-    self._write_data_cmd()
-    self._start()
+    # skip the transfer if the display already shows these segments
+    n = len(segments)
+    if pos + n <= 6:
+      shadow  = self._shadow
+      mask    = ((1 << n) - 1) << pos
+      changed = self._valid & mask != mask
+      for i in range(n):
+        seg = segments[i] & 0xff
+        if shadow[pos+i] != seg:
+          shadow[pos+i] = seg
+          changed = True
+      if not changed:
+        return
+      self._valid |= mask
+    else:
+      self._valid = 0
 
-    self._write_byte(TM1637._CMD2 | pos)
-    for seg in segments:
-      self._write_byte(seg)
-    self._stop()
-    self._write_dsp_ctrl()
+    # data command and display control are latched by the TM1637, they
+    # are only sent by _write_ctrl()
+    self._write_many(TM1637._CMD2 | pos, segments)
+    self._flush_bits(self._bits)
 
   def encode_digit(self, digit):
     """Convert a character 0-9, a-f to a segment."""
     return TM1637._SEGMENTS[digit & 0x0f]
 
+  def _buffer(self, length):
+    """Return a buffer for length segments, reusing the scratch buffer if
+    it is large enough."""
+    if length <= len(self._scratch):
+      return self._scratch_mv[:length]
+    return bytearray(length)
+
   def encode_string(self, string):
     """Convert an up to 4 character length string containing 0-9, a-z,
     space, dash, star to an array of segments, matching the length of the
     source string."""
-    segments = bytearray(len(string))
+    return bytearray(self._encode_string(string))
+
+  def _encode_string(self, string):
+    # like encode_string(), but the result is only valid until the next call
+    segments = self._buffer(len(string))
     for i in range(len(string)):
-      segments[i] = self.encode_char(string[i])
+      o = ord(string[i])
+      v = TM1637._ASCII[o] if o < 128 else 0xFF
+      if v == 0xFF:
+        raise ValueError("Character out of range: {:d} '{:s}'".format(o, chr(o)))
+      segments[i] = v
     return segments
 
   def encode_char(self, char):
     """Convert a character 0-9, a-z, space, dash or star to a segment."""
     o = ord(char)
-    if o == 32:
-      return TM1637._SEGMENTS[36] # space
-    if o == 42:
-      return TM1637._SEGMENTS[38] # star/degrees
-    if o == 45:
-      return TM1637._SEGMENTS[37] # dash
-    if o >= 65 and o <= 90:
-      return TM1637._SEGMENTS[o-55] # uppercase A-Z
-    if o >= 97 and o <= 122:
-      return TM1637._SEGMENTS[o-87] # lowercase a-z
-    if o >= 48 and o <= 57:
-      return TM1637._SEGMENTS[o-48] # 0-9
-    raise ValueError("Character out of range: {:d} '{:s}'".format(o, chr(o)))
+    v = TM1637._ASCII[o] if o < 128 else 0xFF
+    if v == 0xFF:
+      raise ValueError("Character out of range: {:d} '{:s}'".format(o, chr(o)))
+    return v
+
+  def _encode_number(self, num, width, pos=0, fill=0x00):
+    """Encode an integer right aligned into width segments of the scratch
+    buffer, starting at pos. Leading positions are set to fill."""
+    segments = self._scratch
+    n = -num if num < 0 else num
+    i = pos + width - 1
+    while True:
+      segments[i] = TM1637._SEGMENTS[n % 10]
+      n //= 10
+      i -= 1
+      if not n:
+        break
+    if num < 0:
+      segments[i] = TM1637._SEGMENTS[37] # dash
+      i -= 1
+    while i >= pos:
+      segments[i] = fill
+      i -= 1
 
   def hex(self, val):
     """Display a hex value 0x0000 through 0xffff, right aligned."""
-    string = '{:04x}'.format(val & 0xffff)
-    self.write(self.encode_string(string))
+    digits   = TM1637._HEX_DIGITS
+    segments = self._scratch
+    segments[0] = digits[(val >> 12) & 0x0f]
+    segments[1] = digits[(val >> 8) & 0x0f]
+    segments[2] = digits[(val >> 4) & 0x0f]
+    segments[3] = digits[val & 0x0f]
+    self.write(self._scratch_mv[:4])
 
   def number(self, num):
     """Display a numeric value -999 through 9999, right aligned."""
     # limit to range -999 to 9999
     num = max(-999, min(num, 9999))
-    string = '{0: >4d}'.format(num)
-    self.write(self.encode_string(string))
+    self._encode_number(num, 4)
+    self.write(self._scratch_mv[:4])
 
   def numbers(self, num1, num2, colon=True):
     """Display two numeric values -9 through 99, with leading zeros
     and separated by a colon."""
     num1 = max(-9, min(num1, 99))
     num2 = max(-9, min(num2, 99))
-    segments = self.encode_string('{0:0>2d}{1:0>2d}'.format(num1, num2))
+    self._encode_number(num1, 2, 0, TM1637._SEGMENTS[0])
+    self._encode_number(num2, 2, 2, TM1637._SEGMENTS[0])
     if colon:
-      segments[1] |= 0x80 # colon on
-    self.write(segments)
+      self._scratch[1] |= 0x80 # colon on
+    self.write(self._scratch_mv[:4])
 
   def temperature(self, num):
     if num < -9:
-      self.show('lo') # low
+      self.write(TM1637._LO)
     elif num > 99:
-      self.show('hi') # high
+      self.write(TM1637._HI)
     else:
-      string = '{0: >2d}'.format(num)
-      self.write(self.encode_string(string))
-    self.write([TM1637._SEGMENTS[38], TM1637._SEGMENTS[12]], 2) # degrees C
+      self._encode_number(num, 2)
+      self.write(self._scratch_mv[:2])
+    self.write(TM1637._DEG_C, 2)
 
   def show(self, string, colon=False):
-    segments = self.encode_string(string)
+    segments = self._encode_string(string)
     if len(segments) > 1 and colon:
       segments[1] |= 128
     self.write(segments[:4])
 
   def scroll(self, string, delay=0.25):
-    segments = string if isinstance(string, list) else self.encode_string(string)
-    data = [0] * 8
-    data[4:0] = list(segments)
-    for i in range(len(segments) + 5):
-      self.write(data[0+i:4+i])
+    segments = bytearray(string) if isinstance(string, list) else self._encode_string(string)
+    # segments padded with four blanks on both sides, written through a
+    # sliding window
+    n = len(segments)
+    data = bytearray(n + 8)
+    data[4:4+n] = segments
+    data = memoryview(data)
+    for i in range(n + 5):
+      self.write(data[i:i+4])
       time.sleep(delay)
 
 # ---------------------------------------------------------------------------
 
+class TM1637PIO(TM1637):
+  """Library for quad 7-segment LED modules based on the TM1637 LED driver.
+
+  This class clocks out the data with a PIO state machine instead of
+  toggling the pins from Python. It needs a RP2040 and the adafruit_pioasm
+  library.
+  """
+
+  _FREQUENCY = 1000000  # state machine clock, about 200kHz on the bus
+  _LAST      = 0x100    # marks the last byte of a transaction
+
+  def _init_bus(self, clk, dio):
+    if rp2pio is None:
+      raise RuntimeError("TM1637PIO needs rp2pio and adafruit_pioasm")
+    self._bits = array.array('H')
+    self._sm = rp2pio.StateMachine(
+      adafruit_pioasm.assemble(_PIO_PROGRAM),
+      frequency=TM1637PIO._FREQUENCY,
+      first_out_pin=dio,
+      initial_out_pin_state=1,
+      first_set_pin=dio,
+      initial_set_pin_state=1,
+      first_sideset_pin=clk,
+      initial_sideset_pin_state=1,
+      out_shift_right=True)
+
+  # self._bits holds the FIFO entries of the state machine
+
+  def _write_many(self, cmd, data=b''):
+    words = self._bits
+    words.append(cmd)
+    for b in data:
+      words.append(b)
+    words[-1] |= TM1637PIO._LAST
+
+  def _flush_bits(self, bits):
+    self._sm.write(bits)
+    self._bits = array.array('H')
+
+# ---------------------------------------------------------------------------
+
 class TM1637Decimal(TM1637):
   """Library for quad 7-segment LED modules based on the TM1637 LED driver.
 
@@ -223,12 +401,19 @@ class TM1637Decimal(TM1637):
     Convert an up to 4 character length string containing 0-9, a-z,
     space, dash, star and '.' to an array of segments, matching the length of
     the source string."""
-    segments = bytearray(len(string.replace('.','')))
+    return bytearray(self._encode_string(string))
+
+  def _encode_string(self, string):
+    segments = self._buffer(len(string) - string.count('.'))
     j = 0
-    for i in range(len(string)):
-      if string[i] == '.' and j > 0:
+    for c in string:
+      if c == '.' and j > 0:
         segments[j-1] |= TM1637._MSB
         continue
-      segments[j] = self.encode_char(string[i])
+      o = ord(c)
+      v = TM1637._ASCII[o] if o < 128 else 0xFF
+      if v == 0xFF:
+        raise ValueError("Character out of range: {:d} '{:s}'".format(o, chr(o)))
+      segments[j] = v
       j += 1
     return segments
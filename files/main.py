@@ -11,4 +11,5 @@ if __name__ == "__main__":
   while True:
     t = time.localtime()
     display.numbers(t.tm_hour,t.tm_min)
-    time.sleep(60-(t.tm_sec%60))
+    # wake up at the start of the next minute, measured after the update
+    time.sleep(60-(time.time()%60))